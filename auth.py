@@ -1,7 +1,9 @@
 import logging
+import time
 from flask_login import LoginManager, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from db import db_read, db_write
+import metrics
 
 # Logger für dieses Modul
 logger = logging.getLogger(__name__)
@@ -102,11 +104,18 @@ def authenticate(username, password):
 
     if not user:
         logger.warning("authenticate(): kein User mit username='%s' gefunden", username)
+        metrics.inc("auth_attempts_total", (("result", "unknown_user"),))
         return None
 
-    if check_password_hash(user.password, password):
+    started = time.perf_counter()
+    valid = check_password_hash(user.password, password)
+    metrics.observe("auth_hash_verify_seconds", time.perf_counter() - started)
+
+    if valid:
         logger.info("authenticate(): Passwort korrekt für '%s'", username)
+        metrics.inc("auth_attempts_total", (("result", "success"),))
         return user
 
     logger.warning("authenticate(): falsches Passwort für '%s'", username)
+    metrics.inc("auth_attempts_total", (("result", "wrong_password"),))
     return None
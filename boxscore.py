@@ -0,0 +1,126 @@
+"""
+Box scores: a game with both teams' stat lines and team totals.
+
+build_box_score() fetches everything in one query. Players are attributed to
+the team they played for at game time (player_statistics.team_id, else
+team_history, see db.STAT_TEAM_SQL). Box scores of final games are frozen and
+pinned in the cache together with the version of their stat lines (count and
+highest id); a pinned box score is only served while a cheap index-only query
+still returns that version, so lines added by any worker process show up.
+"""
+
+from datetime import datetime
+from types import MappingProxyType
+
+import cache
+from db import db_read, SEASON_STAT_COLUMNS, STAT_TEAM_SQL
+
+# Final box scores are rebuilt after this long even if their version matches
+FINAL_TTL = 3600
+
+VERSION_SQL = "SELECT COUNT(*) as lines, MAX(id) as max_id FROM player_statistics WHERE game_id = ?"
+
+GAME_COLUMNS = ('id', 'date', 'season', 'home_team_id', 'away_team_id', 'home_score',
+                'away_score', 'home_city', 'home_name', 'away_city', 'away_name')
+LINE_COLUMNS = ('stat_id', 'player_id', 'player_name', 'position', 'team_id') + SEASON_STAT_COLUMNS
+
+BOX_SCORE_SQL = f"""
+    WITH lines AS (
+        SELECT g.id, g.date, g.season, g.home_team_id, g.away_team_id,
+               g.home_score, g.away_score,
+               ht.city as home_city, ht.name as home_name,
+               at.city as away_city, at.name as away_name,
+               ps.id as stat_id, ps.player_id, p.name as player_name, p.position,
+               COALESCE(ps.team_id, {STAT_TEAM_SQL}) as team_id,
+               {', '.join(f'ps.{col}' for col in SEASON_STAT_COLUMNS)}
+        FROM games g
+        JOIN teams ht ON g.home_team_id = ht.id
+        JOIN teams at ON g.away_team_id = at.id
+        LEFT JOIN player_statistics ps ON ps.game_id = g.id
+        LEFT JOIN players p ON ps.player_id = p.id
+        WHERE g.id = ?
+    )
+    SELECT lines.*,
+           {', '.join(f'SUM({col}) OVER per_team as total_{col}' for col in SEASON_STAT_COLUMNS)}
+    FROM lines
+    WINDOW per_team AS (PARTITION BY team_id)
+    ORDER BY team_id, points DESC
+"""
+
+
+def _freeze(value):
+    """Read-only view of a nested dict/list structure."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def is_final(game):
+    """A game is final once its game day is over."""
+    date = game['date']
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return date.date() < datetime.now().date()
+
+
+def build_box_score(game_id):
+    """
+    Build the box score of a game.
+
+    Returns:
+        Read-only mapping with 'game', 'home', 'away' (each with team_id, city,
+        name, score, players and totals) and 'unattributed' lines whose team
+        could not be determined, or None if the game does not exist
+    """
+    pinned = cache.get_pinned(('box_score', game_id))
+    if pinned is not None:
+        version, box = pinned
+        current = db_read(VERSION_SQL, (game_id,), single=True)
+        if (current['lines'], current['max_id']) == version:
+            return box
+
+    rows = db_read(BOX_SCORE_SQL, (game_id,))
+    if not rows:
+        return None
+    stat_ids = [row['stat_id'] for row in rows if row['stat_id'] is not None]
+    version = (len(stat_ids), max(stat_ids, default=None))
+
+    game = {col: rows[0][col] for col in GAME_COLUMNS}
+    teams = {}
+    for side in ('home', 'away'):
+        teams[game[f'{side}_team_id']] = {
+            'team_id': game[f'{side}_team_id'],
+            'city': game[f'{side}_city'],
+            'name': game[f'{side}_name'],
+            'score': game[f'{side}_score'],
+            'players': [],
+            'totals': {col: 0 for col in SEASON_STAT_COLUMNS},
+        }
+    unattributed = []
+    for row in rows:
+        if row['stat_id'] is None:
+            continue  # game without any stat lines
+        line = {col: row[col] for col in LINE_COLUMNS}
+        team = teams.get(row['team_id'])
+        if team is None:
+            unattributed.append(line)
+            continue
+        team['players'].append(line)
+        team['totals'] = {col: row[f'total_{col}'] for col in SEASON_STAT_COLUMNS}
+
+    box = _freeze({
+        'game': game,
+        'home': teams[game['home_team_id']],
+        'away': teams[game['away_team_id']],
+        'unattributed': unattributed,
+    })
+    if is_final(game):
+        cache.pin(('box_score', game_id), (version, box), FINAL_TTL)
+    return box
+
+
+def forget_box_score(game_id):
+    """Drop a pinned box score after its stat lines changed."""
+    cache.unpin(('box_score', game_id))
@@ -0,0 +1,175 @@
+"""
+Small in-process cache for hot, read-mostly queries.
+
+Every write through db_write() clears the cache of this process. Writes of
+other connections, including other worker processes, are noticed through the
+database's PRAGMA data_version (see watch()), which is checked on every lookup
+and costs a few microseconds. Entries also expire after a TTL. Cached values
+are shared between requests and must not be mutated by callers. Expired
+entries are purged whenever an entry is stored, and at most MAX_ENTRIES are
+kept, least recently used first out.
+
+Pinned entries (pin/get_pinned/unpin) are meant for values that no longer
+change, such as box scores of final games; they survive invalidate() and are
+only dropped by unpin(), their own TTL or when more than MAX_PINNED are pinned
+(least recently used first).
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 300
+MAX_ENTRIES = 1024
+MAX_PINNED = 256
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+_pinned = OrderedDict()   # key -> (expires_at, value), least recently used first
+_generation = 0
+
+_connect = None       # callable opening a connection to the watched database
+_watch_conn = None    # that connection, shared by all threads under _lock
+_data_version = None  # last PRAGMA data_version seen on it
+
+
+def _after_fork():
+    """A forked child must not share the parent's SQLite connection."""
+    global _watch_conn, _data_version
+    _watch_conn = None
+    _data_version = None
+    _entries.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def watch(connect):
+    """
+    Drop all cached entries whenever another connection commits to a database.
+
+    Args:
+        connect: Callable returning a new sqlite3 connection that may be used
+            from any thread (check_same_thread=False); opened on first use
+    """
+    global _connect, _watch_conn, _data_version
+    with _lock:
+        _connect = connect
+        _watch_conn = None
+        _data_version = None
+
+
+def _sync():
+    """Clear the entries if the watched database changed; call with _lock held."""
+    global _watch_conn, _data_version, _generation
+    if _connect is None:
+        return
+    if _watch_conn is None:
+        _watch_conn = _connect()
+    version = _watch_conn.execute("PRAGMA data_version").fetchone()[0]
+    if version != _data_version:
+        _data_version = version
+        _generation += 1
+        _entries.clear()
+
+
+def _evict(entries, limit):
+    """Drop expired entries, then the least recently used beyond limit; call with _lock held."""
+    now = time.monotonic()
+    for key in [key for key, (expires, _) in entries.items() if expires is not None and expires <= now]:
+        del entries[key]
+    while len(entries) > limit:
+        entries.popitem(last=False)
+
+
+def invalidate():
+    """Drop all cached entries except pinned ones."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.clear()
+
+
+def cached(ttl=DEFAULT_TTL):
+    """
+    Memoize a function on its positional arguments.
+
+    Omitted trailing arguments are filled in from the defaults, so f(1) and
+    f(1, None) share one entry. The decorated function gets a warm(*args)
+    method that (re)computes an entry.
+
+    Args:
+        ttl: Seconds an entry stays valid, or None to keep it until invalidate()
+    """
+    def decorator(func):
+        defaults = func.__defaults__ or ()
+        arg_count = func.__code__.co_argcount
+
+        def make_key(args):
+            missing = arg_count - len(args)
+            if 0 < missing <= len(defaults):
+                args = args + defaults[len(defaults) - missing:]
+            return (func.__qualname__, args)
+
+        def store(key, args):
+            with _lock:
+                _sync()
+                generation = _generation
+            value = func(*args)
+            with _lock:
+                # Skip storing if a write happened while we were computing
+                if generation == _generation:
+                    expires = None if ttl is None else time.monotonic() + ttl
+                    _entries[key] = (expires, value)
+                    _entries.move_to_end(key)
+                    _evict(_entries, MAX_ENTRIES)
+            return value
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = make_key(args)
+            with _lock:
+                _sync()
+                entry = _entries.get(key)
+                if entry:
+                    _entries.move_to_end(key)
+            if entry and (entry[0] is None or entry[0] > time.monotonic()):
+                return entry[1]
+            return store(key, args)
+
+        def warm(*args):
+            return store(make_key(args), args)
+
+        wrapper.warm = warm
+        return wrapper
+    return decorator
+
+
+def pin(key, value, ttl=None):
+    """Cache an immutable value that survives invalidate()."""
+    with _lock:
+        _pinned[key] = (None if ttl is None else time.monotonic() + ttl, value)
+        _pinned.move_to_end(key)
+        _evict(_pinned, MAX_PINNED)
+
+
+def get_pinned(key):
+    """Return a pinned value, or None if it is missing or expired."""
+    with _lock:
+        entry = _pinned.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            del _pinned[key]
+            return None
+        _pinned.move_to_end(key)
+        return entry[1]
+
+
+def unpin(key):
+    """Drop a pinned value."""
+    with _lock:
+        _pinned.pop(key, None)
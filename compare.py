@@ -0,0 +1,133 @@
+"""
+Player comparisons and team head-to-head records.
+
+compare_players() loads the season lines of all requested players in one
+query from player_season_stats (frozen totals plus live open seasons) and
+derives per-game, per-36 and season splits in a single pass. head_to_head()
+aggregates all games between two teams per season in one query. Both are
+memoized in the cache.
+"""
+
+from cache import cached
+from db import db_read, SEASON_STAT_COLUMNS
+
+MIN_PLAYERS = 2
+MAX_PLAYERS = 10
+
+# Columns that get per-game and per-36 values (minutes are the per-36 basis)
+RATE_COLUMNS = tuple(col for col in SEASON_STAT_COLUMNS if col != 'minutes_played')
+
+
+def _split(games_played, totals):
+    """Per-game and per-36 values of summed stat totals."""
+    minutes = totals['minutes_played']
+    return {
+        'games_played': games_played,
+        'minutes_per_game': minutes / games_played if games_played else None,
+        'per_game': {col: totals[col] / games_played if games_played else None for col in RATE_COLUMNS},
+        'per_36': {col: totals[col] * 36 / minutes if minutes else None for col in RATE_COLUMNS},
+    }
+
+
+@cached()
+def _compare(player_ids):
+    placeholders = ', '.join('?' for _ in player_ids)
+    rows = db_read(f"""
+        WITH lines AS (
+            SELECT * FROM player_season_stats WHERE player_id IN ({placeholders})
+        )
+        SELECT p.id, p.name, p.position, lines.season, lines.games_played,
+               {', '.join(f'lines.{col}' for col in SEASON_STAT_COLUMNS)}
+        FROM players p
+        LEFT JOIN lines ON lines.player_id = p.id
+        WHERE p.id IN ({placeholders})
+    """, player_ids + player_ids)
+
+    players = {}
+    for row in rows:
+        player = players.setdefault(row['id'], {
+            'id': row['id'], 'name': row['name'], 'position': row['position'],
+            'games_played': 0, 'totals': {col: 0 for col in SEASON_STAT_COLUMNS}, 'seasons': {},
+        })
+        if row['season'] is None:
+            continue  # player without any stat lines
+        totals = {col: row[col] or 0 for col in SEASON_STAT_COLUMNS}
+        player['seasons'][row['season']] = _split(row['games_played'], totals)
+        player['games_played'] += row['games_played']
+        for col in SEASON_STAT_COLUMNS:
+            player['totals'][col] += totals[col]
+
+    seasons = sorted({s for p in players.values() for s in p['seasons']}, reverse=True)
+    result = []
+    for player_id in player_ids:
+        player = players.get(player_id)
+        if player is None:
+            continue  # deleted since compare_players() checked it
+        career = _split(player['games_played'], player['totals'])
+        result.append({
+            'id': player['id'], 'name': player['name'], 'position': player['position'],
+            'career': career,
+            # Aligned: every player has an entry (or None) for every season
+            'seasons': [player['seasons'].get(season) for season in seasons],
+        })
+    return {'players': result, 'seasons': seasons}
+
+
+def compare_players(player_ids):
+    """
+    Compare 2 to 10 players side by side.
+
+    Args:
+        player_ids: Player IDs in display order (duplicates and IDs of
+            unknown players are ignored)
+
+    Returns:
+        Dict with 'seasons' (newest first) and 'players', each with its career
+        split and one split (or None) per season, aligned with 'seasons'
+
+    Raises:
+        ValueError: If fewer than 2 or more than 10 distinct existing players are given
+    """
+    player_ids = tuple(dict.fromkeys(int(pid) for pid in player_ids))
+    if len(player_ids) <= MAX_PLAYERS:
+        # Only existing players make it into the cache key
+        placeholders = ', '.join('?' for _ in player_ids)
+        known = {row['id'] for row in db_read(f"SELECT id FROM players WHERE id IN ({placeholders})", player_ids)}
+        player_ids = tuple(pid for pid in player_ids if pid in known)
+    if not MIN_PLAYERS <= len(player_ids) <= MAX_PLAYERS:
+        raise ValueError(f"Compare between {MIN_PLAYERS} and {MAX_PLAYERS} players")
+    return _compare(player_ids)
+
+
+@cached()
+def head_to_head(team_a, team_b):
+    """
+    Head-to-head record of two teams across seasons. Games without a score
+    (still 0-0, not played yet) are left out.
+
+    Returns:
+        Dict with 'seasons' (newest first) and 'total', each with games,
+        wins_a, wins_b, points_a and points_b (average points per game)
+    """
+    seasons = db_read("""
+        SELECT season, COUNT(*) as games,
+               SUM((home_team_id = :a AND home_score > away_score)
+                   OR (away_team_id = :a AND away_score > home_score)) as wins_a,
+               SUM((home_team_id = :b AND home_score > away_score)
+                   OR (away_team_id = :b AND away_score > home_score)) as wins_b,
+               SUM(CASE WHEN home_team_id = :a THEN home_score ELSE away_score END) as points_a,
+               SUM(CASE WHEN home_team_id = :b THEN home_score ELSE away_score END) as points_b
+        FROM games
+        WHERE ((home_team_id = :a AND away_team_id = :b)
+               OR (home_team_id = :b AND away_team_id = :a))
+          AND home_score + away_score > 0
+        GROUP BY season
+        ORDER BY season DESC
+    """, {'a': team_a, 'b': team_b})
+
+    total = {key: sum(s[key] for s in seasons)
+             for key in ('games', 'wins_a', 'wins_b', 'points_a', 'points_b')}
+    for split in seasons + [total]:
+        for key in ('points_a', 'points_b'):
+            split[key] = split[key] / split['games'] if split['games'] else None
+    return {'seasons': seasons, 'total': total}
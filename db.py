@@ -1,9 +1,27 @@
 import sqlite3
 import os
+import time
 from datetime import datetime
+import cache
+from cache import invalidate
+import metrics
 
 DB_FILE = 'nba_stats.db'
 
+# Bump whenever init_db() changes, so ensure_schema() re-runs the DDL
+SCHEMA_VERSION = 6
+
+# Functions called with the SQL of every successful db_write()
+_write_hooks = []
+
+# NBA seasons start in October; a season is keyed by the year it starts in
+SEASON_START_MONTH = 10
+SEASON_SQL = "CAST(substr(date, 1, 4) AS INTEGER) - (CAST(substr(date, 6, 2) AS INTEGER) < 10)"
+
+# Per-player, per-season columns summed up by the season views
+SEASON_STAT_COLUMNS = ('points', 'rebounds', 'assists', 'minutes_played',
+                       'steals', 'blocks', 'turnovers')
+
 # Register converters for date/datetime types
 def convert_date(val):
     """Convert stored date string back to datetime object."""
@@ -17,10 +35,41 @@ sqlite3.register_adapter(datetime, lambda val: val.isoformat())
 sqlite3.register_converter("DATE", convert_date)
 sqlite3.register_converter("DATETIME", convert_date)
 
+# Team a stat line's player played for at game time, for lines without a stored
+# team_id: the team_history entry covering the game date, else the current team,
+# as long as that team took part in the game. Expects aliases ps, g and p.
+# Open team_history entries have a NULL end_date; '' (stored by older versions,
+# possibly still in old snapshots) counts as open too.
+STAT_TEAM_SQL = """
+    COALESCE(
+        (SELECT th.team_id FROM team_history th
+         WHERE th.player_id = ps.player_id
+           AND th.team_id IN (g.home_team_id, g.away_team_id)
+           AND th.start_date <= g.date
+           AND (NULLIF(th.end_date, '') IS NULL OR th.end_date >= g.date)
+         ORDER BY th.start_date DESC LIMIT 1),
+        CASE WHEN p.current_team_id IN (g.home_team_id, g.away_team_id)
+             THEN p.current_team_id END)
+"""
+
+def season_for_date(value):
+    """Return the season key (start year) for a date, datetime or ISO string."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.year if value.month >= SEASON_START_MONTH else value.year - 1
+
+def current_season():
+    """Return the season key of today's date."""
+    return season_for_date(datetime.now())
+
+# Clear the cache whenever any connection, in any process, commits a write
+cache.watch(lambda: sqlite3.connect(DB_FILE, check_same_thread=False))
+
 def get_conn():
     """Get a database connection."""
     conn = sqlite3.connect(DB_FILE, detect_types=sqlite3.PARSE_DECLTYPES)
     conn.row_factory = sqlite3.Row  # Enable column access by name
+    metrics.inc('db_connections_opened_total')
     return conn
 
 def db_read(sql, params=None, single=False):
@@ -35,6 +84,9 @@ def db_read(sql, params=None, single=False):
     Returns:
         Single dict or list of dicts
     """
+    started = time.perf_counter()
+    labels = (('statement', metrics.statement_label(sql)),)
+    rows_decoded = 0
     conn = get_conn()
     try:
         cur = conn.cursor()
@@ -46,6 +98,7 @@ def db_read(sql, params=None, single=False):
         if single:
             row = cur.fetchone()
             if row:
+                rows_decoded = 1
                 # Convert sqlite3.Row to dict and handle date columns
                 result = {}
                 for i, col in enumerate(columns):
@@ -63,6 +116,7 @@ def db_read(sql, params=None, single=False):
             return None
         else:
             rows = cur.fetchall()
+            rows_decoded = len(rows)
             results = []
             for row in rows:
                 result = {}
@@ -79,6 +133,8 @@ def db_read(sql, params=None, single=False):
             return results
     finally:
         conn.close()
+        metrics.observe('db_read_seconds', time.perf_counter() - started, labels)
+        metrics.inc('db_rows_decoded_total', labels, rows_decoded)
 
 def db_write(sql, params=None):
     """
@@ -91,14 +147,35 @@ def db_write(sql, params=None):
     Returns:
         The rowid of the last modified row (for INSERT)
     """
+    started = time.perf_counter()
     conn = get_conn()
     try:
         cur = conn.cursor()
         cur.execute(sql, params or ())
         conn.commit()
-        return cur.lastrowid
+        invalidate()
+        lastrowid = cur.lastrowid
     finally:
         conn.close()
+        metrics.observe('db_write_seconds', time.perf_counter() - started,
+                        (('statement', metrics.statement_label(sql)),))
+    for hook in _write_hooks:
+        hook(sql)
+    return lastrowid
+
+def register_write_hook(hook):
+    """Call hook(sql) after every successful db_write()."""
+    _write_hooks.append(hook)
+
+def _season_sums(alias):
+    """SUM() select list over SEASON_STAT_COLUMNS for a player_statistics alias."""
+    return ', '.join(f'SUM({alias}.{col}) AS {col}' for col in SEASON_STAT_COLUMNS)
+
+def _ensure_column(cur, table, column, definition):
+    """Add a column to an existing table if an older schema lacks it."""
+    cur.execute(f"PRAGMA table_xinfo({table})")
+    if column not in [row[1] for row in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
 def init_db():
     """Initialize the database with the required tables."""
@@ -129,7 +206,7 @@ def init_db():
         ''')
         
         # Create Games table
-        cur.execute('''
+        cur.execute(f'''
             CREATE TABLE IF NOT EXISTS games (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 date DATE NOT NULL,
@@ -137,11 +214,14 @@ def init_db():
                 away_team_id INTEGER NOT NULL,
                 home_score INTEGER DEFAULT 0,
                 away_score INTEGER DEFAULT 0,
+                season INTEGER GENERATED ALWAYS AS ({SEASON_SQL}) VIRTUAL,
                 FOREIGN KEY (home_team_id) REFERENCES teams(id),
                 FOREIGN KEY (away_team_id) REFERENCES teams(id),
                 CHECK (home_team_id != away_team_id)
             )
         ''')
+        _ensure_column(cur, 'games', 'season',
+                       f'INTEGER GENERATED ALWAYS AS ({SEASON_SQL}) VIRTUAL')
         
         # Create PlayerStatistics table
         cur.execute('''
@@ -156,10 +236,13 @@ def init_db():
                 steals INTEGER DEFAULT 0,
                 blocks INTEGER DEFAULT 0,
                 turnovers INTEGER DEFAULT 0,
+                team_id INTEGER,
                 FOREIGN KEY (player_id) REFERENCES players(id),
-                FOREIGN KEY (game_id) REFERENCES games(id)
+                FOREIGN KEY (game_id) REFERENCES games(id),
+                FOREIGN KEY (team_id) REFERENCES teams(id)
             )
         ''')
+        _ensure_column(cur, 'player_statistics', 'team_id', 'INTEGER REFERENCES teams(id)')
         
         # Create TeamHistory table
         cur.execute('''
@@ -183,7 +266,173 @@ def init_db():
             )
         ''')
         
+        # Indexes for season-filtered pages, team-at-game-time lookups and matchups
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_games_season_date ON games(season, date)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_player_statistics_player ON player_statistics(player_id, game_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_player_statistics_game ON player_statistics(game_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_team_history_player ON team_history(player_id, start_date)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_games_home_away ON games(home_team_id, away_team_id)')
+        
+        # Open team_history entries used to be stored with '' instead of NULL
+        cur.execute("UPDATE team_history SET end_date = NULL WHERE end_date = ''")
+        
+        # Attribute older stat lines to the team the player played for back then
+        cur.execute(f'''
+            UPDATE player_statistics AS ps SET team_id = (
+                SELECT {STAT_TEAM_SQL}
+                FROM games g JOIN players p ON p.id = ps.player_id
+                WHERE g.id = ps.game_id
+            )
+            WHERE ps.team_id IS NULL
+        ''')
+        
+        # High-water marks of the incremental integrity check (see integrity.py)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS integrity_marks (
+                table_name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL
+            )
+        ''')
+        
+        # Frozen per-season totals for past seasons (see compact_seasons)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS frozen_seasons (
+                season INTEGER PRIMARY KEY,
+                frozen_at DATETIME NOT NULL
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS player_season_totals (
+                player_id INTEGER NOT NULL,
+                season INTEGER NOT NULL,
+                games_played INTEGER NOT NULL,
+                points INTEGER NOT NULL,
+                rebounds INTEGER NOT NULL,
+                assists INTEGER NOT NULL,
+                minutes_played INTEGER NOT NULL,
+                steals INTEGER NOT NULL,
+                blocks INTEGER NOT NULL,
+                turnovers INTEGER NOT NULL,
+                PRIMARY KEY (player_id, season),
+                FOREIGN KEY (player_id) REFERENCES players(id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Older schemas could leave unfrozen seasons below the newest frozen one
+        cur.execute('''
+            SELECT DISTINCT season FROM games
+            WHERE season < (SELECT MAX(season) FROM frozen_seasons)
+              AND season NOT IN (SELECT season FROM frozen_seasons)
+        ''')
+        for (season,) in cur.fetchall():
+            _freeze_season(cur, season)
+        
+        # All-time view: frozen seasons from the totals, the seasons after the
+        # newest frozen one aggregated live. CROSS JOIN keeps games as the outer
+        # loop, so only the open seasons' games and their stat lines are read.
+        columns = ', '.join(SEASON_STAT_COLUMNS)
+        cur.execute('DROP VIEW IF EXISTS player_season_stats')
+        cur.execute(f'''
+            CREATE VIEW player_season_stats AS
+                SELECT player_id, season, games_played, {columns}
+                FROM player_season_totals
+                UNION ALL
+                SELECT ps.player_id, g.season, COUNT(*) AS games_played,
+                       {_season_sums('ps')}
+                FROM games g
+                CROSS JOIN player_statistics ps ON ps.game_id = g.id
+                WHERE g.season > (SELECT IFNULL(MAX(season), 0) FROM frozen_seasons)
+                GROUP BY ps.player_id, g.season
+        ''')
+        
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
         print("Database initialized successfully!")
     finally:
         conn.close()
+
+def ensure_schema():
+    """
+    Run init_db() only if the schema is missing or outdated.
+
+    Checks PRAGMA user_version, which init_db() sets to SCHEMA_VERSION, so an
+    up-to-date database costs a single pragma read instead of the whole DDL.
+
+    Returns:
+        True if the DDL was run, False if the schema was already current
+    """
+    conn = get_conn()
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    if version >= SCHEMA_VERSION:
+        return False
+    init_db()
+    return True
+
+def _freeze_season(cur, season):
+    """(Re)materialize the per-player totals of one season and mark it frozen."""
+    columns = ', '.join(SEASON_STAT_COLUMNS)
+    cur.execute("DELETE FROM player_season_totals WHERE season = ?", (season,))
+    cur.execute(f"""
+        INSERT INTO player_season_totals (player_id, season, games_played, {columns})
+        SELECT ps.player_id, g.season, COUNT(*), {_season_sums('ps')}
+        FROM games g
+        CROSS JOIN player_statistics ps ON ps.game_id = g.id
+        WHERE g.season = ?
+        GROUP BY ps.player_id
+    """, (season,))
+    cur.execute("INSERT OR REPLACE INTO frozen_seasons (season, frozen_at) VALUES (?, ?)",
+                (season, datetime.now()))
+
+def compact_seasons(before=None):
+    """
+    Freeze finished seasons into player_season_totals.
+
+    Every season older than `before` (default: the current season) that is not
+    frozen yet gets its per-player totals materialized, so all-time queries read
+    one row per player and season instead of every single stat line. Frozen
+    seasons always form a prefix: player_season_stats aggregates only the
+    seasons after the newest frozen one live.
+
+    Returns:
+        List of the season keys that were frozen
+    """
+    if before is None:
+        before = current_season()
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT DISTINCT season FROM games
+            WHERE season < ? AND season NOT IN (SELECT season FROM frozen_seasons)
+            ORDER BY season
+        """, (before,))
+        seasons = [row[0] for row in cur.fetchall()]
+        for season in seasons:
+            _freeze_season(cur, season)
+        conn.commit()
+        invalidate()
+        return seasons
+    finally:
+        conn.close()
+
+def refreeze_season(season):
+    """
+    Recompute the frozen totals of a season after its stat lines changed.
+
+    Seasons after the newest frozen one are aggregated live and left alone.
+    """
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(season) FROM frozen_seasons")
+        newest = cur.fetchone()[0]
+        if newest is not None and season <= newest:
+            _freeze_season(cur, season)
+            conn.commit()
+            # The stat line's own db_write() invalidated before the totals changed
+            invalidate()
+    finally:
+        conn.close()
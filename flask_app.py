@@ -6,16 +6,32 @@ Implements 5 use cases for managing basketball data.
 Uses sqlite3 directly with helper functions from db.py.
 """
 
-from flask import Flask, render_template, redirect, url_for, flash, request, abort
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, g, render_template, redirect, url_for, flash, request, abort
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from datetime import datetime
-from db import db_read, db_write, init_db
+from db import db_read, db_write, init_db, ensure_schema, compact_seasons, refreeze_season
 from auth import User, login_manager, register_user, authenticate
+from cache import cached
+from boxscore import build_box_score, forget_box_score
+from compare import compare_players, head_to_head, MAX_PLAYERS
+import metrics
+import click
+import logging
 import os
+import threading
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'
 
+# Optional: re-check integrity incrementally after every write
+if os.environ.get("INTEGRITY_CHECK_ON_WRITE"):
+    from integrity import enable_post_write_check
+    enable_post_write_check()
+
 # Custom template filter for date formatting
 @app.template_filter('format_date')
 def format_date(value, format_str='%B %d, %Y'):
@@ -33,6 +49,36 @@ def format_date(value, format_str='%B %d, %Y'):
         # It's already a datetime object
         return value.strftime(format_str)
 
+@app.template_filter('format_season')
+def format_season(season):
+    """Format a season key (its start year) like 2024-25."""
+    if season is None:
+        return 'All Time'
+    return f"{season}-{(season + 1) % 100:02d}"
+
+@app.template_filter('format_stat')
+def format_stat(value):
+    """Format an average with one decimal, or a dash if there is none."""
+    if value is None:
+        return '-'
+    return f"{value:.1f}"
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and record its latency per route."""
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        labels = (("endpoint", endpoint), ("method", request.method))
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started, labels)
+        metrics.inc("http_requests_total", labels + (("status", str(response.status_code)),))
+        metrics.flush()
+    return response
+
 # Initialize Flask-Login
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -40,6 +86,7 @@ login_manager.login_view = 'login'
 
 # ============== Helper Functions ==============
 
+@cached()
 def get_teams():
     """Get all teams with player count."""
     return db_read("""
@@ -54,15 +101,27 @@ def get_team(team_id):
     """Get a single team by ID."""
     return db_read("SELECT * FROM teams WHERE id = ?", (team_id,), single=True)
 
+@cached()
+def get_team_players(team_id):
+    """Get the current roster of a team."""
+    return db_read("SELECT * FROM players WHERE current_team_id = ?", (team_id,))
+
+@cached()
 def get_players():
     """Get all players with their stats."""
     return db_read("""
         SELECT p.*, t.city, t.name as team_name,
-               (SELECT AVG(points) FROM player_statistics WHERE player_id = p.id) as avg_points,
-               (SELECT AVG(rebounds) FROM player_statistics WHERE player_id = p.id) as avg_rebounds,
-               (SELECT AVG(assists) FROM player_statistics WHERE player_id = p.id) as avg_assists
+               a.avg_points, a.avg_rebounds, a.avg_assists
         FROM players p
         LEFT JOIN teams t ON p.current_team_id = t.id
+        LEFT JOIN (
+            SELECT player_id,
+                   SUM(points) * 1.0 / SUM(games_played) as avg_points,
+                   SUM(rebounds) * 1.0 / SUM(games_played) as avg_rebounds,
+                   SUM(assists) * 1.0 / SUM(games_played) as avg_assists
+            FROM player_season_stats
+            GROUP BY player_id
+        ) a ON a.player_id = p.id
         ORDER BY p.name
     """)
 
@@ -70,17 +129,24 @@ def get_player(player_id):
     """Get a single player by ID."""
     return db_read("SELECT p.*, t.city, t.name as team_name FROM players p LEFT JOIN teams t ON p.current_team_id = t.id WHERE p.id = ?", (player_id,), single=True)
 
-def get_games():
-    """Get all games."""
-    return db_read("""
+def get_games(season=None):
+    """Get all games, or only the games of one season."""
+    where, params = ("WHERE g.season = ?", (season,)) if season is not None else ("", ())
+    return db_read(f"""
         SELECT g.*, 
                ht.city as home_city, ht.name as home_name,
                at.city as away_city, at.name as away_name
         FROM games g
         JOIN teams ht ON g.home_team_id = ht.id
         JOIN teams at ON g.away_team_id = at.id
+        {where}
         ORDER BY g.date DESC
-    """)
+    """, params)
+
+@cached()
+def get_seasons():
+    """Get all season keys that have games, newest first."""
+    return [row["season"] for row in db_read("SELECT DISTINCT season FROM games ORDER BY season DESC")]
 
 def get_game(game_id):
     """Get a single game by ID."""
@@ -94,28 +160,19 @@ def get_game(game_id):
         WHERE g.id = ?
     """, (game_id,), single=True)
 
-def get_player_stats(player_id):
-    """Get all statistics for a player."""
-    return db_read("""
-        SELECT ps.*, g.date, g.home_score, g.away_score,
+def get_player_stats(player_id, season=None):
+    """Get all statistics for a player, optionally for one season only."""
+    where, params = ("AND g.season = ?", (player_id, season)) if season is not None else ("", (player_id,))
+    return db_read(f"""
+        SELECT ps.*, g.date, g.season, g.home_score, g.away_score,
                ht.name as home_team, at.name as away_team
         FROM player_statistics ps
         JOIN games g ON ps.game_id = g.id
         JOIN teams ht ON g.home_team_id = ht.id
         JOIN teams at ON g.away_team_id = at.id
-        WHERE ps.player_id = ?
+        WHERE ps.player_id = ? {where}
         ORDER BY g.date DESC
-    """, (player_id,))
-
-def get_game_stats(game_id):
-    """Get all player statistics for a game."""
-    return db_read("""
-        SELECT ps.*, p.name as player_name, p.position, t.city, t.name as team_name
-        FROM player_statistics ps
-        JOIN players p ON ps.player_id = p.id
-        LEFT JOIN teams t ON p.current_team_id = t.id
-        WHERE ps.game_id = ?
-    """, (game_id,))
+    """, params)
 
 def get_team_history(player_id):
     """Get team history for a player."""
@@ -127,13 +184,27 @@ def get_team_history(player_id):
         ORDER BY th.start_date DESC
     """, (player_id,))
 
-def calculate_player_averages(player_id):
-    """Calculate career averages for a player."""
-    stats = db_read("""
-        SELECT AVG(points) as avg_points, AVG(rebounds) as avg_rebounds, 
-               AVG(assists) as avg_assists, COUNT(*) as games_played
-        FROM player_statistics WHERE player_id = ?
-    """, (player_id,), single=True)
+@cached()
+def get_player_seasons(player_id):
+    """Get all season keys a player has statistics for, newest first."""
+    rows = db_read("SELECT season FROM player_season_stats WHERE player_id = ? ORDER BY season DESC", (player_id,))
+    return [row["season"] for row in rows]
+
+@cached()
+def calculate_player_averages(player_id, season=None):
+    """Calculate career averages for a player, or the averages of one season.
+
+    Reads the player_season_stats view, so frozen seasons come from their
+    precomputed totals instead of being re-aggregated.
+    """
+    where, params = ("AND season = ?", (player_id, season)) if season is not None else ("", (player_id,))
+    stats = db_read(f"""
+        SELECT SUM(points) * 1.0 / SUM(games_played) as avg_points,
+               SUM(rebounds) * 1.0 / SUM(games_played) as avg_rebounds,
+               SUM(assists) * 1.0 / SUM(games_played) as avg_assists,
+               COALESCE(SUM(games_played), 0) as games_played
+        FROM player_season_stats WHERE player_id = ? {where}
+    """, params, single=True)
     return stats
 
 
@@ -244,9 +315,22 @@ def team_detail(team_id):
     if not team:
         abort(404)
     
-    players = db_read("SELECT * FROM players WHERE current_team_id = ?", (team_id,))
+    players = get_team_players(team_id)
     
-    return render_template("team_detail.html", team=team, players=players)
+    return render_template("team_detail.html", team=team, players=players, teams=get_teams())
+
+
+@app.route("/teams/<int:team_a>/vs/<int:team_b>")
+def team_head_to_head(team_a, team_b):
+    """Head-to-head record of two teams across seasons."""
+    first = get_team(team_a)
+    second = get_team(team_b)
+    if not first or not second or team_a == team_b:
+        abort(404)
+    
+    record = head_to_head(team_a, team_b)
+    
+    return render_template("head_to_head.html", team_a=first, team_b=second, record=record)
 
 
 # ============== Player Routes ==============
@@ -292,15 +376,35 @@ def player_detail(player_id):
     if not player:
         abort(404)
     
-    statistics = get_player_stats(player_id)
+    season = request.args.get("season", type=int)
+    statistics = get_player_stats(player_id, season)
     team_history = get_team_history(player_id)
-    averages = calculate_player_averages(player_id)
+    averages = calculate_player_averages(player_id, season)
     
     return render_template("player_detail.html", 
                          player=player,
                          statistics=statistics,
                          team_history=team_history,
-                         averages=averages)
+                         averages=averages,
+                         seasons=get_player_seasons(player_id),
+                         season=season)
+
+
+@app.route("/compare")
+def compare():
+    """Side-by-side comparison of 2 to 10 players."""
+    player_ids = request.args.getlist("player_id", type=int)
+    comparison = None
+    if player_ids:
+        try:
+            comparison = compare_players(player_ids)
+        except ValueError:
+            flash(f"Bitte 2 bis {MAX_PLAYERS} Spieler auswählen.", "error")
+    
+    return render_template("compare.html",
+                         players=get_players(),
+                         selected=player_ids,
+                         comparison=comparison)
 
 
 @app.route("/players/<int:player_id>/history", methods=["GET", "POST"])
@@ -317,16 +421,17 @@ def add_team_history(player_id):
     if request.method == "POST":
         team_id = request.form["team_id"]
         start_date = request.form["start_date"]
-        end_date = request.form.get("end_date")
+        end_date = request.form.get("end_date") or None  # empty: still with the team
         
         if team_id and start_date:
-            db_write("INSERT INTO team_history (player_id, team_id, start_date, end_date) VALUES (?, ?, ?, ?)",
-                    (player_id, team_id, start_date, end_date))
-            
-            # Update player's current team if no end date
+            # Update player's current team if no end date (before the history
+            # row, so a post-write integrity check sees both in agreement)
             if not end_date:
                 db_write("UPDATE players SET current_team_id = ? WHERE id = ?", (team_id, player_id))
             
+            db_write("INSERT INTO team_history (player_id, team_id, start_date, end_date) VALUES (?, ?, ?, ?)",
+                    (player_id, team_id, start_date, end_date))
+            
             flash("Team-Historie erfolgreich hinzugefügt!", "success")
             return redirect(url_for("player_detail", player_id=player_id))
     
@@ -337,9 +442,13 @@ def add_team_history(player_id):
 
 @app.route("/games")
 def games_list():
-    """List all games."""
-    games = get_games()
-    return render_template("games.html", games=games)
+    """List the games of one season (latest by default) or, with ?season=all, all games."""
+    seasons = get_seasons()
+    season = request.args.get("season", type=int)
+    if season is None and request.args.get("season") != "all":
+        season = seasons[0] if seasons else None
+    games = get_games(season)
+    return render_template("games.html", games=games, seasons=seasons, season=season)
 
 
 @app.route("/games/add", methods=["GET", "POST"])
@@ -373,14 +482,12 @@ def add_game():
 
 @app.route("/games/<int:game_id>")
 def game_detail(game_id):
-    """View game details and statistics."""
-    game = get_game(game_id)
-    if not game:
+    """View the box score of a game."""
+    box = build_box_score(game_id)
+    if not box:
         abort(404)
     
-    statistics = get_game_stats(game_id)
-    
-    return render_template("game_detail.html", game=game, statistics=statistics)
+    return render_template("game_detail.html", game=box["game"], box=box)
 
 
 @app.route("/games/<int:game_id>/stats", methods=["GET", "POST"])
@@ -392,8 +499,8 @@ def add_game_stats(game_id):
         abort(404)
     
     # Get players from both teams
-    home_players = db_read("SELECT * FROM players WHERE current_team_id = ?", (game["home_team_id"],))
-    away_players = db_read("SELECT * FROM players WHERE current_team_id = ?", (game["away_team_id"],))
+    home_players = get_team_players(game["home_team_id"])
+    away_players = get_team_players(game["away_team_id"])
     all_players = home_players + away_players
     
     if request.method == "POST":
@@ -407,11 +514,16 @@ def add_game_stats(game_id):
         turnovers = request.form.get("turnovers", 0)
         
         if player_id and points:
+            # Remember the team the player plays for in this game
+            team_id = next((p["current_team_id"] for p in all_players if str(p["id"]) == player_id), None)
             db_write("""
                 INSERT INTO player_statistics 
-                (player_id, game_id, points, rebounds, assists, minutes_played, steals, blocks, turnovers)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (player_id, game_id, points, rebounds, assists, minutes, steals, blocks, turnovers))
+                (player_id, game_id, points, rebounds, assists, minutes_played, steals, blocks, turnovers, team_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (player_id, game_id, points, rebounds, assists, minutes, steals, blocks, turnovers, team_id))
+            # Stats for a past season change its frozen totals
+            refreeze_season(game["season"])
+            forget_box_score(game_id)
             flash("Spieler-Statistiken erfolgreich hinzugefügt!", "success")
             return redirect(url_for("game_detail", game_id=game_id))
         else:
@@ -422,11 +534,31 @@ def add_game_stats(game_id):
 
 # ============== Utility Routes ==============
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics of all worker processes."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/init-db")
 def init_database():
-    """Initialize database with tables."""
-    init_db()
-    flash("Datenbank erfolgreich initialisiert!", "success")
+    """Initialize database with tables, unless the schema is already current."""
+    if ensure_schema():
+        flash("Datenbank erfolgreich initialisiert!", "success")
+    else:
+        flash("Datenbank ist bereits aktuell.", "info")
+    return redirect(url_for("index"))
+
+
+@app.route("/compact-seasons")
+@login_required
+def compact_database():
+    """Freeze all finished seasons into precomputed per-season totals."""
+    seasons = compact_seasons()
+    if seasons:
+        flash(f"Saisons eingefroren: {', '.join(str(s) for s in seasons)}", "success")
+    else:
+        flash("Keine abgeschlossenen Saisons zum Einfrieren.", "info")
     return redirect(url_for("index"))
 
 
@@ -475,18 +607,68 @@ def seed_database():
         VALUES ('2025-01-15', 1, 2, 118, 112)
     """)
     
-    # Create sample stats
-    for player_id in range(1, 6):
+    # Create sample stats for the players of both teams in the game
+    for player_id, (_, _, _, team_id) in enumerate(players_data, start=1):
+        if team_id not in (1, 2):
+            continue
         db_write("""
             INSERT INTO player_statistics 
-            (player_id, game_id, points, rebounds, assists, minutes_played, steals, blocks, turnovers)
-            VALUES (?, 1, 20, 5, 5, 30, 1, 1, 2)
-        """, (player_id,))
+            (player_id, game_id, points, rebounds, assists, minutes_played, steals, blocks, turnovers, team_id)
+            VALUES (?, 1, 20, 5, 5, 30, 1, 1, 2, ?)
+        """, (player_id, team_id))
     
     flash("Beispieldaten erfolgreich hinzugefügt!", "success")
     return redirect(url_for("index"))
 
 
+# ============== CLI Commands ==============
+
+def _report(action, result):
+    """Print rows/s and MB/s of a snapshot export or import."""
+    seconds = max(result["seconds"], 1e-9)
+    mb = result["bytes"] / 1e6
+    print(f"{action} {result['rows']} rows ({mb:.1f} MB) in {seconds:.2f}s: "
+          f"{result['rows'] / seconds:,.0f} rows/s, {mb / seconds:.1f} MB/s")
+
+
+@app.cli.command("export-db")
+@click.argument("path")
+@click.option("--chunk-size", default=65536, show_default=True, help="Rows per chunk.")
+def export_db_command(path, chunk_size):
+    """Export teams, players, games, stats and team history into a snapshot file."""
+    from snapshot import export_snapshot
+    _report("Exported", export_snapshot(path, chunk_size))
+
+
+@app.cli.command("import-db")
+@click.argument("path")
+def import_db_command(path):
+    """Load a snapshot file into an empty database."""
+    from snapshot import import_snapshot
+    init_db()
+    try:
+        result = import_snapshot(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    _report("Imported", result)
+
+
+@app.cli.command("check-integrity")
+@click.option("--full", is_flag=True, help="Audit all rows instead of only new ones.")
+def check_integrity_command(full):
+    """Check the data for inconsistencies the schema cannot prevent."""
+    from integrity import run_checks
+    ensure_schema()
+    report = run_checks(full=full)
+    for violation in report["violations"]:
+        print(f"{violation['check']}: id={violation['row_id']}: {violation['detail']}")
+    ranges = ", ".join(f"{table} {lo + 1}-{hi}" for table, (lo, hi) in report["ranges"].items() if hi > lo)
+    print(f"{report['mode'].capitalize()} check ({ranges or 'no new rows'}) in "
+          f"{report['seconds'] * 1000:.1f} ms: {len(report['violations'])} violation(s)")
+    if report["violations"]:
+        raise SystemExit(1)
+
+
 # ============== Error Handlers ==============
 
 @app.errorhandler(404)
@@ -501,8 +683,61 @@ def internal_server_error(e):
 
 # ============== App Start ==============
 
+STARTUP_TIMINGS = {"imports": time.perf_counter() - _import_started}
+
+
+def _timed(phase, func, *args):
+    """Run one startup phase and record its duration."""
+    started = time.perf_counter()
+    result = func(*args)
+    STARTUP_TIMINGS[phase] = time.perf_counter() - started
+    logger.info("startup: Phase '%s' in %.1f ms", phase, STARTUP_TIMINGS[phase] * 1000)
+    return result
+
+
+def precompile_templates():
+    """Compile all templates once, so the first requests don't pay for it."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def warm_caches():
+    """Fill the hot caches: team list, rosters, player list and roster aggregates.
+
+    Uses the same arguments as the routes, so the warmed entries are the ones
+    they read.
+    """
+    for team in get_teams.warm():
+        for player in get_team_players.warm(team["id"]):
+            calculate_player_averages.warm(player["id"], None)
+            get_player_seasons.warm(player["id"])
+    get_players.warm()
+    get_seasons.warm()
+
+
+def warm_up_async():
+    """Warm the caches in a background thread; call once per worker process."""
+    thread = threading.Thread(target=_timed, args=("warm-up", warm_caches),
+                              name="cache-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def startup(warm=True):
+    """
+    Prepare the app before serving: check the schema version, precompile all
+    templates and (optionally) start warming the caches in the background.
+
+    Under gunicorn with preload_app, call startup(warm=False) in the master
+    and warm_up_async() in each worker after the fork (see gunicorn.conf.py).
+    """
+    _timed("schema", ensure_schema)
+    _timed("templates", precompile_templates)
+    if warm:
+        warm_up_async()
+
+
 if __name__ == "__main__":
-    # Initialize database on first run
-    if not os.path.exists('nba_stats.db'):
-        init_db()
+    logging.basicConfig(level=logging.INFO)
+    startup()
     app.run(debug=True)
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for pre-fork deployments:
+
+    gunicorn flask_app:app
+
+The app is imported and prepared once in the master (schema check, template
+compilation) and inherited by the forked workers; each worker then warms its
+own caches in a background thread. Per-phase startup times are logged.
+Metrics of all workers are aggregated through files in METRICS_DIR.
+"""
+
+import logging
+import os
+
+preload_app = True
+workers = 4
+
+# Workers dump their metrics here; /metrics sums them across workers
+os.environ.setdefault("METRICS_DIR", os.path.join(os.getcwd(), "metrics"))
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear_store()
+
+
+def when_ready(server):
+    # Send the app's startup timings (including each worker's warm-up) to
+    # gunicorn's error log; forked workers inherit this setup
+    app_logger = logging.getLogger("flask_app")
+    app_logger.handlers = list(server.log.error_log.handlers)
+    app_logger.setLevel(logging.INFO)
+    app_logger.propagate = False
+    from flask_app import startup, STARTUP_TIMINGS
+    startup(warm=False)
+    server.log.info("startup: %s", ", ".join(
+        f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in STARTUP_TIMINGS.items()))
+
+
+def post_fork(server, worker):
+    from flask_app import warm_up_async
+    warm_up_async()
@@ -0,0 +1,158 @@
+"""
+Data integrity checks for the NBA statistics database.
+
+Each check is one SQL query that reports rows breaking a rule the schema
+cannot enforce. A full audit checks every row; an incremental run only checks
+rows with ids above the high-water marks stored in integrity_marks by the
+previous run (plus players whose team history got new rows). Updates of
+existing rows, e.g. of players.current_team_id, are only seen by a full audit.
+
+The CLI and the optional post-write hook keep separate marks, so rows the
+hook has already checked are still reported by the next CLI run.
+"""
+
+import logging
+import threading
+import time
+
+from db import db_read, get_conn, register_write_hook, STAT_TEAM_SQL
+
+logger = logging.getLogger(__name__)
+
+# Tables whose new rows an incremental run checks
+TRACKED_TABLES = ('players', 'player_statistics', 'team_history')
+
+# Mark sets in integrity_marks; the CLI's marks use the plain table names
+CLI = 'cli'
+POST_WRITE = 'post_write'
+
+# Open team_history entries have a NULL end_date; '' (stored by older versions,
+# possibly still in old snapshots) counts as open too
+OPEN_END = "'9999-12-31'"
+
+# name -> SQL; each query gets the :<table>_lo / :<table>_hi id range of every
+# tracked table and returns row_id and detail
+CHECKS = {
+    'stat_orphan': """
+        SELECT ps.id as row_id,
+               'player ' || ps.player_id || ', game ' || ps.game_id as detail
+        FROM player_statistics ps
+        LEFT JOIN players p ON p.id = ps.player_id
+        LEFT JOIN games g ON g.id = ps.game_id
+        WHERE ps.id > :player_statistics_lo AND ps.id <= :player_statistics_hi
+          AND (p.id IS NULL OR g.id IS NULL)
+    """,
+    'stat_team_not_in_game': f"""
+        SELECT id as row_id,
+               'player ' || player_id || ' (team ' || IFNULL(team_id, 'unknown') || ') in game ' ||
+               game_id || ' (' || home_team_id || ' vs ' || away_team_id || ')' as detail
+        FROM (
+            SELECT ps.id, ps.player_id, ps.game_id, g.home_team_id, g.away_team_id,
+                   COALESCE(ps.team_id, {STAT_TEAM_SQL}) as team_id
+            FROM player_statistics ps
+            JOIN games g ON g.id = ps.game_id
+            JOIN players p ON p.id = ps.player_id
+            WHERE ps.id > :player_statistics_lo AND ps.id <= :player_statistics_hi
+        )
+        WHERE team_id IS NULL OR team_id NOT IN (home_team_id, away_team_id)
+    """,
+    'team_history_end_before_start': """
+        SELECT id as row_id, 'player ' || player_id || ': ' || start_date || ' - ' || end_date as detail
+        FROM team_history
+        WHERE id > :team_history_lo AND id <= :team_history_hi
+          AND NULLIF(end_date, '') IS NOT NULL AND end_date < start_date
+    """,
+    'team_history_overlap': f"""
+        SELECT b.id as row_id,
+               'player ' || b.player_id || ': overlaps team_history ' || a.id as detail
+        FROM team_history b
+        JOIN team_history a ON a.player_id = b.player_id AND a.id < b.id
+        WHERE b.id > :team_history_lo AND b.id <= :team_history_hi
+          AND a.start_date <= COALESCE(NULLIF(b.end_date, ''), {OPEN_END})
+          AND b.start_date <= COALESCE(NULLIF(a.end_date, ''), {OPEN_END})
+    """,
+    'current_team_mismatch': """
+        SELECT p.id as row_id,
+               'current team ' || IFNULL(p.current_team_id, 'none') ||
+               ', open team_history ' || th.id || ' says ' || th.team_id as detail
+        FROM players p
+        JOIN team_history th ON th.player_id = p.id AND NULLIF(th.end_date, '') IS NULL
+        WHERE ((p.id > :players_lo AND p.id <= :players_hi)
+               OR p.id IN (SELECT player_id FROM team_history
+                           WHERE id > :team_history_lo AND id <= :team_history_hi))
+          AND p.current_team_id IS NOT th.team_id
+    """,
+}
+
+_lock = threading.Lock()
+
+
+def _mark_name(marks, table):
+    return table if marks == CLI else f'{marks}:{table}'
+
+
+def _read_marks(conn, marks):
+    rows = conn.execute("SELECT table_name, last_id FROM integrity_marks").fetchall()
+    stored = {row[0]: row[1] for row in rows}
+    return {table: stored.get(_mark_name(marks, table), 0) for table in TRACKED_TABLES}
+
+
+def run_checks(full=False, marks=CLI):
+    """
+    Run all checks, over every row or only over rows written since the last run.
+
+    Args:
+        full: Check every row instead of only rows above the marks
+        marks: Which set of high-water marks to read and advance
+
+    Returns:
+        Dict with mode, violations (check, row_id, detail), the checked id
+        ranges per table and seconds
+    """
+    started = time.perf_counter()
+    with _lock:
+        conn = get_conn()
+        try:
+            lows = {} if full else _read_marks(conn, marks)
+            params = {}
+            for table in TRACKED_TABLES:
+                params[f'{table}_lo'] = lows.get(table, 0)
+                params[f'{table}_hi'] = conn.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0]
+
+            violations = []
+            for name, sql in CHECKS.items():
+                for row in db_read(sql, params):
+                    violations.append({'check': name, 'row_id': row['row_id'], 'detail': row['detail']})
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO integrity_marks (table_name, last_id) VALUES (?, ?)",
+                [(_mark_name(marks, table), params[f'{table}_hi']) for table in TRACKED_TABLES])
+            conn.commit()
+        finally:
+            conn.close()
+
+    return {
+        'mode': 'full' if full else 'incremental',
+        'violations': violations,
+        'ranges': {table: (params[f'{table}_lo'], params[f'{table}_hi']) for table in TRACKED_TABLES},
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def _check_after_write(sql):
+    """Post-write hook: incremental check after writes to tracked tables."""
+    if not any(table in sql for table in TRACKED_TABLES):
+        return
+    try:
+        report = run_checks(marks=POST_WRITE)
+    except Exception:
+        logger.exception("integrity: Prüfung nach Schreibzugriff fehlgeschlagen")
+        return
+    for violation in report['violations']:
+        logger.warning("integrity: %s bei id=%s: %s",
+                       violation['check'], violation['row_id'], violation['detail'])
+
+
+def enable_post_write_check():
+    """Run the incremental check after every db_write() to a tracked table."""
+    register_write_hook(_check_after_write)
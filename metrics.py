@@ -0,0 +1,208 @@
+"""
+Prometheus-style metrics for routes, database calls and authentication.
+
+Counters and histograms live in process memory behind one lock. If the
+METRICS_DIR environment variable is set (gunicorn.conf.py does that), every
+process also dumps its values to METRICS_DIR/metrics_<pid>_<token>.json at
+most once per FLUSH_INTERVAL seconds, and render() sums the files of all
+worker processes.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint and method.'),
+    'db_read_seconds': ('histogram', 'db_read() calls and duration by statement.'),
+    'db_write_seconds': ('histogram', 'db_write() calls and duration by statement.'),
+    'db_rows_decoded_total': ('counter', 'Rows decoded by db_read() by statement.'),
+    'db_connections_opened_total': ('counter', 'SQLite connections opened.'),
+    'auth_hash_verify_seconds': ('histogram', 'Password hash verification time in authenticate().'),
+    'auth_attempts_total': ('counter', 'authenticate() calls by result.'),
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()  # keeps an older dump from replacing a newer one
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [count per bucket..., sum]
+_last_flush = 0.0
+_token = uuid.uuid4().hex[:8]
+
+
+def _reset():
+    """Forget everything inherited from the parent after a fork."""
+    global _last_flush, _token
+    _counters.clear()
+    _histograms.clear()
+    _last_flush = 0.0
+    _token = uuid.uuid4().hex[:8]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def inc(name, labels=(), value=1):
+    """Increase a counter. Labels are a tuple of (key, value) pairs."""
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, labels=()):
+    """Record one observation in a histogram."""
+    key = (name, labels)
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(BUCKETS) + 1)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+                break
+        values[-1] += seconds
+
+
+@functools.lru_cache(maxsize=512)
+def statement_label(sql):
+    """
+    Short, single-line label for an SQL statement.
+
+    Long statements are cut and get a hash of the whole normalized text, so
+    statements sharing a prefix (get_game and get_games) keep separate labels.
+    """
+    label = ' '.join(sql.split())
+    if len(label) <= 80:
+        return label
+    digest = hashlib.sha1(label.encode()).hexdigest()[:8]
+    return f'{label[:68]}... #{digest}'
+
+
+def _store_dir():
+    return os.environ.get('METRICS_DIR')
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, labels, values[:]] for (name, labels), values in _histograms.items()],
+        }
+
+
+def flush(force=False):
+    """
+    Write this process's values to METRICS_DIR (throttled unless forced).
+
+    Errors are logged, never raised, so a failed dump cannot break a request.
+    """
+    global _last_flush
+    store = _store_dir()
+    if not store:
+        return
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_flush < FLUSH_INTERVAL:
+            return
+        _last_flush = now
+    path = os.path.join(store, f'metrics_{os.getpid()}_{_token}.json')
+    try:
+        with _flush_lock:
+            os.makedirs(store, exist_ok=True)
+            # Unique temp file per call, so no two flushes ever share one
+            fd, tmp = tempfile.mkstemp(dir=store, prefix='.tmp_', suffix='.json')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(_snapshot(), f)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+    except Exception:
+        logger.exception("metrics: Schreiben nach %s fehlgeschlagen", store)
+
+
+def clear_store():
+    """Remove the dumps of earlier runs; call once in the gunicorn master."""
+    store = _store_dir()
+    if not store or not os.path.isdir(store):
+        return
+    for name in os.listdir(store):
+        if name.startswith('metrics_'):
+            os.remove(os.path.join(store, name))
+
+
+def _collect():
+    """Sum the values of all processes, or just this one without a store."""
+    store = _store_dir()
+    if not store:
+        snapshots = [_snapshot()]
+    else:
+        flush(force=True)
+        snapshots = []
+        for name in os.listdir(store):
+            if name.startswith('metrics_') and name.endswith('.json'):
+                try:
+                    with open(os.path.join(store, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # a worker is replacing its file right now
+
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snap['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, v in enumerate(values):
+                total[i] += v
+    return counters, histograms
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def render():
+    """Render all metrics in the Prometheus text exposition format."""
+    counters, histograms = _collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
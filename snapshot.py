@@ -0,0 +1,183 @@
+"""
+Columnar snapshot export/import for the NBA statistics database.
+
+A snapshot is a zip archive of .npy members (readable with numpy.load):
+
+    __meta__.npy                      0-d str array holding JSON: format version,
+                                      tables, their columns and chunk/row counts
+    <table>/<chunk>/<col>.npy         int64 values of an all-integer column
+    <table>/<chunk>/<col>.null.npy    bool NULL mask (only if the chunk has NULLs)
+    <table>/<chunk>/<col>.codes.npy   int32 dictionary codes of any other column
+                                      (-1 = NULL)
+    <table>/<chunk>/<col>.dict.npy    str array with the distinct values of the chunk
+
+Chunks are numbered 000000, 000001, ... and hold at most CHUNK_SIZE rows, so
+export and import never keep more than one chunk of a table in memory.
+The users table is never exported.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import zipfile
+
+import numpy as np
+
+from db import DB_FILE
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 65536
+
+# Parents before children, so foreign keys resolve while importing
+TABLES = ('teams', 'players', 'games', 'player_statistics', 'team_history')
+
+
+def _raw_conn():
+    """Connection without type converters, so dates stay plain strings."""
+    return sqlite3.connect(DB_FILE)
+
+
+def _table_columns(cur, table):
+    """Stored columns of a table (generated columns are left out)."""
+    cur.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cur.fetchall()]
+
+
+def _write_array(zf, name, arr):
+    with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, arr, allow_pickle=False)
+
+
+def _write_column(zf, prefix, values):
+    """Write one column of a chunk, as int64 if possible, else dictionary-encoded."""
+    if all(v is None or type(v) is int for v in values):
+        nulls = [v is None for v in values]
+        _write_array(zf, prefix, np.array([0 if v is None else v for v in values], dtype=np.int64))
+        if any(nulls):
+            _write_array(zf, prefix + '.null', np.array(nulls, dtype=bool))
+        return
+    lookup = {}
+    codes = np.array([-1 if v is None else lookup.setdefault(str(v), len(lookup)) for v in values],
+                     dtype=np.int32)
+    _write_array(zf, prefix + '.codes', codes)
+    _write_array(zf, prefix + '.dict', np.array(list(lookup), dtype=str))
+
+
+def _read_column(npz, prefix):
+    """Read one column of a chunk back into a list of Python values."""
+    if prefix + '.codes' in npz.files:
+        lookup = npz[prefix + '.dict'].tolist()
+        return [None if c < 0 else lookup[c] for c in npz[prefix + '.codes'].tolist()]
+    values = npz[prefix].tolist()
+    if prefix + '.null' in npz.files:
+        values = [None if null else v for v, null in zip(values, npz[prefix + '.null'].tolist())]
+    return values
+
+
+def export_snapshot(path, chunk_size=CHUNK_SIZE):
+    """
+    Export all data tables into a snapshot file.
+
+    Args:
+        path: Target file (overwritten)
+        chunk_size: Maximum number of rows held in memory per chunk
+
+    Returns:
+        Dict with rows, bytes and seconds
+    """
+    start = time.perf_counter()
+    meta = {'version': FORMAT_VERSION, 'chunk_size': chunk_size, 'tables': {}}
+    total_rows = 0
+    conn = _raw_conn()
+    try:
+        cur = conn.cursor()
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for table in TABLES:
+                columns = _table_columns(cur, table)
+                cur.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+                chunks = rows = 0
+                while True:
+                    batch = cur.fetchmany(chunk_size)
+                    if not batch:
+                        break
+                    for col, values in zip(columns, zip(*batch)):
+                        _write_column(zf, f"{table}/{chunks:06d}/{col}", values)
+                    chunks += 1
+                    rows += len(batch)
+                meta['tables'][table] = {'columns': columns, 'chunks': chunks, 'rows': rows}
+                total_rows += rows
+            _write_array(zf, '__meta__', np.array(json.dumps(meta)))
+    finally:
+        conn.close()
+    return {'rows': total_rows, 'bytes': os.path.getsize(path),
+            'seconds': time.perf_counter() - start}
+
+
+def import_snapshot(path):
+    """
+    Bulk-load a snapshot into an initialized, empty database.
+
+    Secondary indexes of the imported tables are dropped for the load and
+    rebuilt once at the end; everything runs in a single transaction.
+
+    Returns:
+        Dict with rows, bytes and seconds
+
+    Raises:
+        ValueError: If the snapshot format is unknown, names a table or column
+            the database does not have, or a table already has rows
+    """
+    start = time.perf_counter()
+    total_rows = 0
+    with np.load(path, allow_pickle=False) as npz:
+        meta = json.loads(npz['__meta__'].item())
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {meta.get('version')}")
+
+        conn = _raw_conn()
+        try:
+            cur = conn.cursor()
+            # Names from the snapshot end up in SQL, so only known ones pass
+            for table, info in meta['tables'].items():
+                if table not in TABLES:
+                    raise ValueError(f"Unknown table in snapshot: {table!r}")
+                unknown = set(info['columns']) - set(_table_columns(cur, table))
+                if unknown:
+                    raise ValueError(f"Unknown columns in snapshot table {table}: "
+                                     f"{', '.join(sorted(map(repr, unknown)))}")
+            for table in meta['tables']:
+                cur.execute(f"SELECT 1 FROM {table} LIMIT 1")
+                if cur.fetchone():
+                    raise ValueError(f"Table {table} already contains data")
+
+            cur.execute("PRAGMA synchronous = OFF")
+            cur.execute("BEGIN")
+            placeholders = ', '.join('?' for _ in meta['tables'])
+            cur.execute(f"""
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+            """, tuple(meta['tables']))
+            indexes = cur.fetchall()
+            for name, _ in indexes:
+                cur.execute(f"DROP INDEX {name}")
+
+            for table, info in meta['tables'].items():
+                columns = info['columns']
+                sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                       f"VALUES ({', '.join('?' for _ in columns)})")
+                for chunk in range(info['chunks']):
+                    values = [_read_column(npz, f"{table}/{chunk:06d}/{col}") for col in columns]
+                    cur.executemany(sql, zip(*values))
+                total_rows += info['rows']
+
+            for _, sql in indexes:
+                cur.execute(sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    return {'rows': total_rows, 'bytes': os.path.getsize(path),
+            'seconds': time.perf_counter() - start}